@@ -1,7 +1,9 @@
 ﻿# Copyright (c) Microsoft Corporation and contributors.
 # Licensed under the MIT License.
 
-from typing import Any, Collection, Dict, List, Optional, Tuple, Union
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union, cast
 
 import matplotlib as mpl
 import matplotlib.axes
@@ -12,15 +14,16 @@ import seaborn as sns
 import sklearn.mixture
 from beartype import beartype
 from matplotlib.axes import Axes
-from matplotlib.collections import LineCollection
-from matplotlib.colors import Colormap
+from matplotlib.collections import LineCollection, PatchCollection
+from matplotlib.colors import Colormap, ListedColormap
+from matplotlib.lines import Line2D
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from scipy import linalg
-from scipy.sparse import csr_matrix
+from scipy.sparse import coo_matrix, csr_matrix, issparse
 from sklearn.preprocessing import Binarizer
 from sklearn.utils import check_array, check_consistent_length, check_X_y
 
-from ..embed import select_svd
 from ..preconditions import (
     check_argument,
     check_argument_types,
@@ -43,98 +46,129 @@ def _check_common_inputs(
     title_pad: Optional[float] = None,
     hier_label_fontsize: Optional[float] = None,
 ) -> None:
-    # Handle figsize
-    if figsize is not None:
-        if not isinstance(figsize, tuple):
-            msg = "figsize must be a tuple, not {}.".format(type(figsize))
-            raise TypeError(msg)
-
-    # Handle heights
-    if height is not None:
-        if not isinstance(height, (int, float)):
-            msg = "height must be an integer or float, not {}.".format(type(height))
-            raise TypeError(msg)
-
-    # Handle title
-    if title is not None:
-        if not isinstance(title, str):
-            msg = "title must be a string, not {}.".format(type(title))
-            raise TypeError(msg)
-
-    # Handle context
-    if context is not None:
-        if not isinstance(context, str):
-            msg = "context must be a string, not {}.".format(type(context))
-            raise TypeError(msg)
-        elif context not in ["paper", "notebook", "talk", "poster"]:
-            msg = "context must be one of (paper, notebook, talk, poster), \
-                not {}.".format(
-                context
-            )
-            raise ValueError(msg)
-
-    # Handle font_scale
-    if font_scale is not None:
-        if not isinstance(font_scale, (int, float)):
-            msg = "font_scale must be an integer or float, not {}.".format(
-                type(font_scale)
-            )
-            raise TypeError(msg)
-
-    # Handle legend name
-    if legend_name is not None:
-        if not isinstance(legend_name, str):
-            msg = "legend_name must be a string, not {}.".format(type(legend_name))
-            raise TypeError(msg)
-
-    if hier_label_fontsize is not None:
-        if not isinstance(hier_label_fontsize, (int, float)):
-            msg = "hier_label_fontsize must be a scalar, not {}.".format(
-                type(legend_name)
-            )
+    checks: List[Tuple[str, Any, Union[type, Tuple[type, ...]], str]] = [
+        ("figsize", figsize, tuple, "a tuple"),
+        ("height", height, (int, float), "an integer or float"),
+        ("title", title, str, "a string"),
+        ("context", context, str, "a string"),
+        ("font_scale", font_scale, (int, float), "an integer or float"),
+        ("legend_name", legend_name, str, "a string"),
+        ("hier_label_fontsize", hier_label_fontsize, (int, float), "a scalar"),
+        ("title_pad", title_pad, (int, float), "a scalar"),
+    ]
+    for name, value, types, description in checks:
+        if value is not None and not isinstance(value, types):
+            msg = "{} must be {}, not {}.".format(name, description, type(value))
             raise TypeError(msg)
 
-    if title_pad is not None:
-        if not isinstance(title_pad, (int, float)):
-            msg = "title_pad must be a scalar, not {}.".format(type(legend_name))
-            raise TypeError(msg)
+    if context is not None and context not in ["paper", "notebook", "talk", "poster"]:
+        msg = "context must be one of (paper, notebook, talk, poster), \
+            not {}.".format(
+            context
+        )
+        raise ValueError(msg)
 
 
-def _transform(arr: np.ndarray, method: Optional[str]) -> np.ndarray:
-    if method is not None:
-        if method in ["log", "log10"]:
-            # arr = np.log(arr, where=(arr > 0))
-            # hacky, but np.log(arr, where=arr>0) is really buggy
-            arr = arr.copy()
-            if method == "log":
-                arr[arr > 0] = np.log(arr[arr > 0])
-            else:
-                arr[arr > 0] = np.log10(arr[arr > 0])
-        elif method in ["zero-boost", "simple-all", "simple-nonzero"]:
-            arr = pass_to_ranks(arr, method=method)
-        elif method == "binarize":
-            transformer = Binarizer().fit(arr)
-            arr = transformer.transform(arr)
-        else:
-            msg = f"Transform must be one of {{log, log10, binarize, zero-boost, \
-            simple-all, simple-nonzero}}, not {method}."
-            raise ValueError(msg)
+@lru_cache(maxsize=64)
+def _color_palette(
+    palette: str, n_colors: int, desat: Optional[float] = None
+) -> Tuple[Tuple[float, float, float], ...]:
+    """Memoized :func:`seaborn.color_palette` for named palettes"""
+    return tuple(sns.color_palette(palette, n_colors=n_colors, desat=desat))
+
+
+@lru_cache(maxsize=16)
+def _plotting_context_rc(context: str, font_scale: float) -> Dict[str, Any]:
+    """Memoized rcParams for :func:`seaborn.plotting_context`; do not modify"""
+    return dict(sns.plotting_context(context, font_scale=font_scale))
+
+
+@contextmanager
+def _plotting_context(context: Optional[str], font_scale: float) -> Iterator[None]:
+    """Like :func:`seaborn.plotting_context`, but only scales a context once"""
+    if context is None:
+        # seaborn takes no context to mean the current rcParams as they are, which
+        # must not be memoized since they change between calls
+        yield
+        return
+    rc = _plotting_context_rc(context, font_scale)
+    saved = {key: mpl.rcParams[key] for key in rc}
+    mpl.rcParams.update(rc)
+    try:
+        yield
+    finally:
+        mpl.rcParams.update(saved)
+
+
+@contextmanager
+def _deferred_redraw(fig: Any) -> Iterator[None]:
+    """Holds back the figure's stale callback, which redraws interactive figures,
+    so that many artist changes request a single redraw at the end"""
+    callback = fig.stale_callback
+    fig.stale_callback = None
+    try:
+        yield
+    finally:
+        fig.stale_callback = callback
+        if callback is not None and fig.stale:
+            callback(fig, True)
+
+
+_LOG_TRANSFORMS: Dict[str, np.ufunc] = {"log": np.log, "log10": np.log10}
+
+
+def _transform(
+    arr: Union[np.ndarray, csr_matrix], method: str
+) -> Union[np.ndarray, csr_matrix]:
+    if issparse(arr):
+        sparse_arr = cast(csr_matrix, arr)
+        if method in _LOG_TRANSFORMS:
+            # only the stored entries can be positive, so transform them alone
+            sparse_arr = sparse_arr.astype(np.float64)
+            data = sparse_arr.data
+            _LOG_TRANSFORMS[method](data, out=data, where=data > 0)
+            return sparse_arr
+        elif method != "binarize":
+            # Binarizer handles sparse input itself; ranks need every entry
+            arr = sparse_arr.toarray()
+    if method in _LOG_TRANSFORMS:
+        # np.log(arr, where=arr > 0) alone leaves the masked-out entries
+        # uninitialized, so supply an explicit copy as the output buffer
+        out = np.array(arr, dtype=np.float64)
+        _LOG_TRANSFORMS[method](arr, out=out, where=arr > 0)
+        arr = out
+    elif method in ["zero-boost", "simple-all", "simple-nonzero"]:
+        arr = pass_to_ranks(arr, method=method)
+    elif method == "binarize":
+        transformer = Binarizer().fit(arr)
+        arr = transformer.transform(arr)
+    else:
+        msg = f"Transform must be one of {{log, log10, binarize, zero-boost, \
+        simple-all, simple-nonzero}}, not {method}."
+        raise ValueError(msg)
 
     return arr
 
 
 def _process_graphs(
-    graphs: Collection[np.ndarray],
+    graphs: Sequence[np.ndarray],
     inner_hier_labels: Optional[Union[np.ndarray, List[Any]]],
     outer_hier_labels: Optional[Union[np.ndarray, List[Any]]],
     transform: Optional[str],
     sort_nodes: bool,
-) -> List[np.ndarray]:
-    """Handles transformation and sorting of graphs for plotting"""
-    for g in graphs:
-        check_consistent_length(g, inner_hier_labels, outer_hier_labels)
-
-    graphs = [_transform(arr, transform) for arr in graphs]
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Handles transformation and sorting of graphs for plotting, also returning
+    the permutation applied to the first graph"""
+    # validate the labels once, then only compare each graph's size against them
+    n_verts = graphs[0].shape[0]
+    check_consistent_length(graphs[0], inner_hier_labels, outer_hier_labels)
+    for g in graphs[1:]:
+        if g.shape[0] != n_verts:
+            msg = "Found input variables with inconsistent numbers of samples: {}"
+            raise ValueError(msg.format([n_verts, g.shape[0]]))
+
+    if transform is not None:
+        graphs = [_transform(arr, transform) for arr in graphs]
 
     if inner_hier_labels is not None:
         inner_hier_labels = np.array(inner_hier_labels)
@@ -143,14 +177,125 @@ def _process_graphs(
         else:
             outer_hier_labels = np.array(outer_hier_labels)
     else:
-        inner_hier_labels = np.ones(graphs[0].shape[0], dtype=int)
+        inner_hier_labels = np.ones(n_verts, dtype=int)
         outer_hier_labels = np.ones_like(inner_hier_labels)
 
-    graphs = [
-        _sort_graph(arr, inner_hier_labels, outer_hier_labels, sort_nodes)
-        for arr in graphs
-    ]
-    return graphs
+    if sort_nodes:
+        all_inds = [
+            _sort_inds(arr, inner_hier_labels, outer_hier_labels, sort_nodes)
+            for arr in graphs
+        ]
+        graphs = [_permute_graph(arr, inds) for arr, inds in zip(graphs, all_inds)]
+        inds = all_inds[0]
+    else:
+        # without sorting by degree the permutation only depends on the labels, so
+        # compute it once and share it between all of the graphs
+        inds = _label_sort_inds(inner_hier_labels, outer_hier_labels)
+        graphs = [_permute_graph(arr, inds) for arr in graphs]
+    return graphs, inds
+
+
+def _block_reduce(arr: np.ndarray, block_size: int, method: str) -> np.ndarray:
+    """Reduces each ``block_size`` by ``block_size`` block of a matrix to its max or
+    mean, with smaller blocks along the last row and column when the shape is not a
+    multiple of ``block_size``"""
+
+    def reduce(blocks: np.ndarray, axis: Any) -> np.ndarray:
+        return blocks.max(axis=axis) if method == "max" else blocks.mean(axis=axis)
+
+    # reshape the block-aligned part as a view and reduce the ragged strips left
+    # over on their own, rather than padding a full copy of the matrix
+    n_rows, n_cols = arr.shape
+    full_rows, full_cols = n_rows // block_size, n_cols // block_size
+    row_split, col_split = full_rows * block_size, full_cols * block_size
+    extra_rows, extra_cols = n_rows - row_split, n_cols - col_split
+    out = np.empty((full_rows + (extra_rows > 0), full_cols + (extra_cols > 0)))
+    out[:full_rows, :full_cols] = reduce(
+        arr[:row_split, :col_split].reshape(
+            full_rows, block_size, full_cols, block_size
+        ),
+        (1, 3),
+    )
+    if extra_cols:
+        out[:full_rows, -1] = reduce(
+            arr[:row_split, col_split:].reshape(full_rows, block_size, extra_cols),
+            (1, 2),
+        )
+    if extra_rows:
+        out[-1, :full_cols] = reduce(
+            arr[row_split:, :col_split].reshape(extra_rows, full_cols, block_size),
+            (0, 2),
+        )
+    if extra_rows and extra_cols:
+        out[-1, -1] = reduce(arr[row_split:, col_split:], None)
+    return out
+
+
+def _imshow_heatmap(
+    arr: np.ndarray,
+    cmap: Union[str, list, Colormap],
+    xticklabels: Union[bool, list],
+    yticklabels: Union[bool, list],
+    cbar_kws: Dict[str, Any],
+    center: Optional[float],
+    cbar: bool,
+    ax: matplotlib.axes.Axes,
+    vmin: Optional[float],
+    vmax: Optional[float],
+    downsample: Optional[str],
+    **kwargs: Any,
+) -> matplotlib.axes.Axes:
+    """Draws a matrix as a single image, laid out like :func:`seaborn.heatmap`"""
+    cmap = ListedColormap(cmap) if isinstance(cmap, list) else plt.get_cmap(cmap)
+    if vmin is None:
+        vmin = np.nanmin(arr)
+    if vmax is None:
+        vmax = np.nanmax(arr)
+    if center is not None:
+        # center the colormap the way seaborn does, by keeping only the part of a
+        # colormap symmetric about center that the data range covers
+        vrange = max(vmax - center, center - vmin)
+        cmin, cmax = mpl.colors.Normalize(center - vrange, center + vrange)(
+            [vmin, vmax]
+        )
+        cmap = ListedColormap(cmap(np.linspace(cmin, cmax, 256)))
+
+    # cell i spans [i, i + 1] so that the group lines and brackets line up
+    n_rows, n_cols = arr.shape
+
+    # there is no point drawing many more cells than the axes has pixels, and the
+    # extent keeps the reduced image in the original cell coordinates
+    if downsample is not None:
+        bbox = ax.get_window_extent()
+        n_pixels = int(max(bbox.width, bbox.height))
+        if max(n_rows, n_cols) > 4 * n_pixels:
+            arr = _block_reduce(arr, max(n_rows, n_cols) // n_pixels, downsample)
+
+    image = ax.imshow(
+        arr,
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+        interpolation="nearest",
+        aspect="equal",
+        extent=(0, n_cols, n_rows, 0),
+        **kwargs,
+    )
+    ax.set(xlim=(0, n_cols), ylim=(n_rows, 0))
+    if cbar:
+        ax.figure.colorbar(image, ax=ax, **cbar_kws)
+
+    ax.set_xticks([])
+    ax.set_yticks([])
+    if isinstance(xticklabels, list):
+        ax.set_xticks(np.arange(n_cols) + 0.5)
+        ax.set_xticklabels(xticklabels, rotation="vertical")
+    if isinstance(yticklabels, list):
+        ax.set_yticks(np.arange(n_rows) + 0.5)
+        ax.set_yticklabels(yticklabels, rotation="horizontal")
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    return ax
 
 
 def heatmap(
@@ -173,6 +318,9 @@ def heatmap(
     ax: Optional[matplotlib.axes.Axes] = None,
     title_pad: Optional[float] = None,
     sort_nodes: bool = False,
+    fast: bool = False,
+    downsample: Optional[str] = "max",
+    rasterize_brackets: bool = False,
     **kwargs: Any,
 ) -> matplotlib.axes.Axes:
     r"""
@@ -189,8 +337,9 @@ def heatmap(
 
     Parameters
     ----------
-    X : nx.Graph or np.ndarray object
-        Graph or numpy matrix to plot
+    X : nx.Graph, np.ndarray or scipy.sparse.csr_matrix object
+        Graph or matrix to plot. Sparse matrices stay sparse through
+        ``transform`` and sorting, and are only made dense to be drawn.
 
     transform : None, or string {'log', 'log10', 'zero-boost', 'simple-all', 'simple-nonzero'}
 
@@ -266,8 +415,25 @@ def heatmap(
         (degree for an unweighted graph). If ``inner_hier_labels`` is passed and
         ``sort_nodes`` is ``True``, will sort nodes this way within block.
 
+    fast : boolean, optional (default=False)
+        Whether to draw the matrix directly with :meth:`matplotlib.axes.Axes.imshow`
+        rather than Seaborn's ``heatmap``, which is much faster for large graphs.
+        The colormap is still centered on ``center``, but ticklabels are only
+        drawn when given as lists.
+
+    downsample : None, or string {'max' (default), 'mean'}
+        Only used if ``fast`` is ``True``. When the graph has more than four times
+        as many nodes as the axes has pixels, blocks of nodes are reduced to their
+        max or mean edge weight before drawing. ``None`` always draws every cell.
+
+    rasterize_brackets : boolean, optional (default=False)
+        Whether to rasterize the brackets drawn for ``inner_hier_labels`` and
+        ``outer_hier_labels`` in vector output such as PDF or SVG, which keeps
+        files small for graphs with many groups.
+
     **kwargs : dict, optional
-        additional plotting arguments passed to Seaborn's ``heatmap``
+        additional plotting arguments passed to Seaborn's ``heatmap``, or to
+        :meth:`matplotlib.axes.Axes.imshow` if ``fast`` is ``True``
     """
     _check_common_inputs(
         figsize=figsize,
@@ -312,32 +478,60 @@ def heatmap(
         msg = "cbar must be a bool, not {}.".format(type(center))
         raise TypeError(msg)
 
+    # Handle downsample
+    if downsample not in [None, "max", "mean"]:
+        msg = "downsample must be one of (max, mean) or None, not {}.".format(
+            downsample
+        )
+        raise ValueError(msg)
+
+    # a csr_matrix is kept sparse here, so transforming and sorting it costs
+    # O(nnz) rather than O(n^2); the one dense copy is made at render time
     arr = import_graph(X)
 
-    arr = _process_graphs(
+    graphs, sorted_inds = _process_graphs(
         [arr], inner_hier_labels, outer_hier_labels, transform, sort_nodes
-    )[0]
+    )
+    arr = graphs[0]
+    if issparse(arr):
+        arr = cast(csr_matrix, arr).toarray()
 
     # Global plotting settings
     CBAR_KWS = dict(shrink=0.7)  # norm=colors.Normalize(vmin=0, vmax=1))
 
-    with sns.plotting_context(context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         if ax is None:
             fig, ax = plt.subplots(figsize=figsize)
-        plot = sns.heatmap(
-            arr,
-            cmap=cmap,
-            square=True,
-            xticklabels=xticklabels,
-            yticklabels=yticklabels,
-            cbar_kws=CBAR_KWS,
-            center=center,
-            cbar=cbar,
-            ax=ax,
-            vmin=vmin,
-            vmax=vmax,
-            **kwargs,
-        )
+        if fast:
+            plot = _imshow_heatmap(
+                arr,
+                cmap=cmap,
+                xticklabels=xticklabels,
+                yticklabels=yticklabels,
+                cbar_kws=CBAR_KWS,
+                center=center,
+                cbar=cbar,
+                ax=ax,
+                vmin=vmin,
+                vmax=vmax,
+                downsample=downsample,
+                **kwargs,
+            )
+        else:
+            plot = sns.heatmap(
+                arr,
+                cmap=cmap,
+                square=True,
+                xticklabels=xticklabels,
+                yticklabels=yticklabels,
+                cbar_kws=CBAR_KWS,
+                center=center,
+                cbar=cbar,
+                ax=ax,
+                vmin=vmin,
+                vmax=vmax,
+                **kwargs,
+            )
 
         if title is not None:
             if title_pad is None:
@@ -356,9 +550,18 @@ def heatmap(
                     inner_hier_labels,
                     outer_hier_labels,
                     fontsize=hier_label_fontsize,
+                    sorted_inds=sorted_inds,
+                    rasterized=rasterize_brackets,
                 )
             else:
-                _plot_groups(plot, arr, inner_hier_labels, fontsize=hier_label_fontsize)
+                _plot_groups(
+                    plot,
+                    arr,
+                    inner_hier_labels,
+                    fontsize=hier_label_fontsize,
+                    sorted_inds=sorted_inds,
+                    rasterized=rasterize_brackets,
+                )
     return plot
 
 
@@ -379,6 +582,7 @@ def gridplot(
     hier_label_fontsize: int = 30,
     title_pad: Optional[float] = None,
     sort_nodes: bool = False,
+    rasterize_brackets: bool = False,
 ) -> matplotlib.axes.Axes:
     r"""
     Plots multiple graphs on top of each other with dots as edges.
@@ -453,6 +657,15 @@ def gridplot(
         Whether or not to sort the nodes of the graph by the sum of edge weights
         (degree for an unweighted graph). If ``inner_hier_labels`` is passed and
         ``sort_nodes`` is ``True``, will sort nodes this way within block.
+    rasterize_brackets : boolean, optional (default=False)
+        Whether to rasterize the brackets drawn for ``inner_hier_labels`` and
+        ``outer_hier_labels`` in vector output such as PDF or SVG.
+
+    Returns
+    -------
+    ax : matplotlib axis object
+        Output plot. Earlier versions returned a seaborn ``FacetGrid``; the figure
+        is now available as ``ax.figure``.
     """
     _check_common_inputs(
         height=height,
@@ -464,7 +677,8 @@ def gridplot(
     )
 
     if isinstance(X, list):
-        graphs = [import_graph(x) for x in X]
+        # nothing below modifies the graphs in place, so arrays need not be copied
+        graphs = [import_graph(x, copy=False) for x in X]
     else:
         msg = "X must be a list, not {}.".format(type(X))
         raise TypeError(msg)
@@ -474,68 +688,102 @@ def gridplot(
 
     check_consistent_length(X, labels)
 
-    graphs = _process_graphs(
-        X, inner_hier_labels, outer_hier_labels, transform, sort_nodes
+    graphs, sorted_inds = _process_graphs(
+        graphs, inner_hier_labels, outer_hier_labels, transform, sort_nodes
     )
 
+    palette_colors: Any = palette
     if isinstance(palette, str):
-        palette = sns.color_palette(palette, desat=0.75, n_colors=len(labels))
-
-    dfs = []
-    for idx, graph in enumerate(graphs):
-        rdx, cdx = np.where(graph > 0)
-        weights = graph[(rdx, cdx)]
-        df = pd.DataFrame(
-            np.vstack([rdx + 0.5, cdx + 0.5, weights]).T,
-            columns=["rdx", "cdx", "Weights"],
-        )
-        df[legend_name] = [labels[idx]] * len(cdx)
-        dfs.append(df)
-
-    df = pd.concat(dfs, axis=0)
+        palette_colors = list(_color_palette(palette, len(labels), desat=0.75))
+    elif isinstance(palette, dict):
+        palette_colors = [palette[label] for label in labels]
+    label_colors = mpl.colors.to_rgba_array(palette_colors)
+
+    edges = []
+    for graph in graphs:
+        coo = coo_matrix(graph)
+        positive = coo.data > 0
+        edges.append((coo.row[positive], coo.col[positive], coo.data[positive]))
+
+    # fill one set of columns rather than concatenating a frame per graph
+    n_edges = sum(len(weights) for _, _, weights in edges)
+    rdx = np.empty(n_edges)
+    cdx = np.empty(n_edges)
+    weights = np.empty(n_edges)
+    graph_inds = np.empty(n_edges, dtype=int)
+    start = 0
+    for idx, (row, col, data) in enumerate(edges):
+        stop = start + len(data)
+        rdx[start:stop] = row + 0.5
+        cdx[start:stop] = col + 0.5
+        weights[start:stop] = data
+        graph_inds[start:stop] = idx
+        start = stop
+
+    # map weights linearly onto the size range, as seaborn's size semantic does
+    if n_edges > 0 and weights.max() > weights.min():
+        edge_sizes = np.interp(weights, (weights.min(), weights.max()), sizes)
+    else:
+        edge_sizes = np.full(n_edges, sizes[0], dtype=float)
 
-    with sns.plotting_context(context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         sns.set_style("white")
-        plot = sns.relplot(
-            data=df,
-            x="cdx",
-            y="rdx",
-            hue=legend_name,
-            size="Weights",
-            sizes=sizes,
+        # widen the figure so the legend anchored outside the axes is not clipped
+        fig, ax = plt.subplots(figsize=(height * 1.25, height))
+        fig.subplots_adjust(right=0.8)
+        # a single scatter call draws every edge of every graph as one collection
+        ax.scatter(
+            cdx,
+            rdx,
+            s=edge_sizes,
+            c=label_colors[graph_inds],
             alpha=alpha,
-            palette=palette,
-            height=height,
-            facet_kws={
-                "sharex": True,
-                "sharey": True,
-                "xlim": (0, graph.shape[0] + 1),
-                "ylim": (0, graph.shape[0] + 1),
-            },
+            linewidths=0,
+        )
+        handles = [
+            Line2D([], [], linestyle="", marker="o", color=color, alpha=alpha)
+            for color in label_colors
+        ]
+        ax.legend(
+            handles,
+            labels,
+            title=legend_name,
+            loc="center left",
+            bbox_to_anchor=(1, 0.5),
+            frameon=False,
         )
-        plot.ax.axis("off")
-        plot.ax.invert_yaxis()
+        ax.set_xlim(0, graph.shape[0] + 1)
+        ax.set_ylim(0, graph.shape[0] + 1)
+        ax.axis("off")
+        ax.invert_yaxis()
         if title is not None:
             if title_pad is None:
                 if inner_hier_labels is not None:
                     title_pad = 1.5 * font_scale + 1 * hier_label_fontsize + 30
                 else:
                     title_pad = 1.5 * font_scale + 15
-            plt.title(title, pad=title_pad)
+            ax.set_title(title, pad=title_pad)
     if inner_hier_labels is not None:
         if outer_hier_labels is not None:
             _plot_groups(
-                plot.ax,
+                ax,
                 graphs[0],
                 inner_hier_labels,
                 outer_hier_labels,
                 fontsize=hier_label_fontsize,
+                sorted_inds=sorted_inds,
+                rasterized=rasterize_brackets,
             )
         else:
             _plot_groups(
-                plot.ax, graphs[0], inner_hier_labels, fontsize=hier_label_fontsize
+                ax,
+                graphs[0],
+                inner_hier_labels,
+                fontsize=hier_label_fontsize,
+                sorted_inds=sorted_inds,
+                rasterized=rasterize_brackets,
             )
-    return plot
+    return ax
 
 
 def pairplot(
@@ -630,7 +878,12 @@ def pairplot(
 
     # Handle col_names
     if col_names is None:
-        col_names = ["Dimension {}".format(i) for i in range(1, X.shape[1] + 1)]
+        col_names = cast(
+            List[str],
+            np.char.add(
+                "Dimension ", np.arange(1, X.shape[1] + 1).astype(str)
+            ).tolist(),
+        )
     elif not isinstance(col_names, list):
         msg = "col_names must be a list, not {}.".format(type(col_names))
         raise TypeError(msg)
@@ -653,16 +906,22 @@ def pairplot(
     else:
         variables = col_names
 
-    df = pd.DataFrame(X, columns=col_names)
+    # build the frame in one go from column views rather than concatenating
+    data = {}
     if labels is not None:
         if legend_name is None:
             legend_name = "Type"
-        df_labels = pd.DataFrame(labels, columns=[legend_name])
-        df = pd.concat([df_labels, df], axis=1)
-
+        data[legend_name] = labels
+    for i, col_name in enumerate(col_names):
+        data[col_name] = X[:, i]
+    df = pd.DataFrame(data, copy=False)
+    palette_colors: Any = palette
+    if labels is not None:
         names, counts = np.unique(labels, return_counts=True)
         if counts.min() < 2:
             diag_kind = "hist"
+        if isinstance(palette, str):
+            palette_colors = list(_color_palette(palette, len(names)))
     plot_kws = dict(
         alpha=alpha,
         s=size,
@@ -670,14 +929,14 @@ def pairplot(
         linewidth=0,
         marker=marker,
     )
-    with sns.plotting_context(context=context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         if labels is not None:
             pairs = sns.pairplot(
                 df,
                 hue=legend_name,
                 vars=variables,
                 height=height,
-                palette=palette,
+                palette=palette_colors,
                 diag_kind=diag_kind,
                 plot_kws=plot_kws,
             )
@@ -686,7 +945,7 @@ def pairplot(
                 df,
                 vars=variables,
                 height=height,
-                palette=palette,
+                palette=palette_colors,
                 diag_kind=diag_kind,
                 plot_kws=plot_kws,
             )
@@ -743,26 +1002,41 @@ def _plot_ellipse_and_data(
     sns.scatterplot(
         data=data, x=X[:, j], y=X[:, k], ax=ax, hue="labels", palette=label_palette
     )
-    for i, (mean, covar) in enumerate(zip(means, covariances)):
-        v, w = linalg.eigh(covar)
-        v = 2.0 * np.sqrt(2.0) * np.sqrt(v)
-        u = w[0] / linalg.norm(w[0])
-        # Plot an ellipse to show the Gaussian component
-        angle = np.arctan(u[1] / u[0])
-        angle = 180.0 * angle / np.pi
-        ell = mpl.patches.Ellipse(
-            [mean[j], mean[k]],
-            v[0],
-            v[1],
-            180.0 + angle,
-            color=cluster_palette[i],
+    # decompose every component's covariance in a single batched call
+    eigvals, eigvecs = np.linalg.eigh(covariances)
+    widths = 2.0 * np.sqrt(2.0) * np.sqrt(eigvals)
+    # orientation from each component's first eigenvector; arctan2 also
+    # handles u[0] == 0, and the sign ambiguity of eigh only rotates by 180
+    u = eigvecs[:, :, 0]
+    angles = np.degrees(np.arctan2(u[:, 1], u[:, 0]))
+    # Plot an ellipse to show each Gaussian component, all as one artist
+    ells = [
+        mpl.patches.Ellipse(
+            [means[i, j], means[i, k]], widths[i, 0], widths[i, 1], 180.0 + angles[i]
         )
-        ell.set_clip_box(ax.bbox)
-        ell.set_alpha(alpha)
-        ax.add_artist(ell)
-        # removes tick marks from off diagonal graphs
-        ax.set(xticks=[], yticks=[], xlabel=k, ylabel=k)
-        ax.legend().remove()
+        for i in range(len(means))
+    ]
+    colors = [cluster_palette[i] for i in range(len(means))]
+    ell_collection = PatchCollection(
+        ells, facecolors=colors, edgecolors=colors, alpha=alpha
+    )
+    ell_collection.set_clip_box(ax.bbox)
+    ax.add_collection(ell_collection, autolim=False)
+    # removes tick marks from off diagonal graphs
+    ax.set(xticks=[], yticks=[], xlabel=k, ylabel=k)
+    ax.legend().remove()
+
+
+def _palette_dict(
+    palette: Union[str, Dict], keys: np.ndarray, n_colors: int, name: str
+) -> Dict[Any, Any]:
+    # a dictionary is used as given, a named palette is assigned to the keys
+    if isinstance(palette, dict):
+        return palette
+    if isinstance(palette, str):
+        return dict(zip(keys, _color_palette(palette, n_colors)))
+    msg = "{} must be a string or dictionary, not {}.".format(name, type(palette))
+    raise ValueError(msg)
 
 
 def pairplot_with_gmm(
@@ -844,6 +1118,7 @@ def pairplot_with_gmm(
     # Handle X and labels
     if labels is not None:
         check_X_y(X, labels)
+        labels = np.asarray(labels)
         # if custom labels pass sets default
         if legend_name is None:
             legend_name = ""
@@ -855,55 +1130,44 @@ def pairplot_with_gmm(
         msg = "You must input a sklearn.mixture.GaussianMixture"
         raise NameError(msg)
     Y_, means, covariances = gmm.predict(X), gmm.means_, gmm.covariances_
-    data = pd.DataFrame(data=X)
     n_components = gmm.n_components
 
     # reformat covariances in preparation for ellipse plotting
+    n_features = X.shape[1]
+    diag_inds = np.arange(n_features)
     if gmm.covariance_type == "tied":
-        covariances = np.repeat(
-            gmm.covariances_[np.newaxis, :, :], n_components, axis=0
+        covariances = np.broadcast_to(
+            gmm.covariances_, (n_components, n_features, n_features)
         )
     elif gmm.covariance_type == "diag":
-        covariances = np.array(
-            [np.diag(gmm.covariances_[i]) for i in range(n_components)]
-        )
+        covariances = np.zeros((n_components, n_features, n_features))
+        covariances[:, diag_inds, diag_inds] = gmm.covariances_
     elif gmm.covariance_type == "spherical":
-        covariances = np.array(
-            [
-                np.diag(np.repeat(gmm.covariances_[i], X.shape[1]))
-                for i in range(n_components)
-            ]
-        )
+        covariances = np.zeros((n_components, n_features, n_features))
+        covariances[:, diag_inds, diag_inds] = gmm.covariances_[:, np.newaxis]
 
-    # setting up the data DataFrame
+    # setting up the data DataFrame from its columns, which avoids copying X
+    columns: Dict[Any, Any] = {i: X[:, i] for i in range(X.shape[1])}
     if labels is None:
-        lab_names = [i for i in range(n_components)]
-        data["labels"] = np.asarray([lab_names[Y_[i]] for i in range(Y_.shape[0])])
+        # clusters are named by their index, so the predictions are the labels
+        columns["labels"] = Y_
     else:
-        data["labels"] = labels
-    data["clusters"] = Y_
-    # labels are given we must check whether input is correct
+        columns["labels"] = labels
+    columns["clusters"] = Y_
+    data = pd.DataFrame(columns, copy=False)
+    unique_clusters = np.unique(Y_)
+    cluster_palette = _palette_dict(
+        cluster_palette, unique_clusters, n_components, "cluster_palette"
+    )
     if labels is not None:
-        if isinstance(label_palette, str):
-            colors = sns.color_palette(label_palette, n_components)
-            label_palette = dict(zip(np.unique(np.asarray(labels)), colors))
-        elif not isinstance(label_palette, dict):
-            msg = "When giving labels must supply palette in string or dictionary"
-            raise ValueError(msg)
-        if isinstance(cluster_palette, str):
-            colors = sns.color_palette(cluster_palette, n_components)
-            cluster_palette = dict(zip(np.unique(Y_), colors))
-        elif not isinstance(label_palette, dict):
-            msg = "When giving labels must supply palette in string or dictionary"
-            raise ValueError(msg)
+        label_palette = _palette_dict(
+            label_palette, np.unique(labels), n_components, "label_palette"
+        )
     else:
-        # no labels given we go to default.
-        colors = sns.color_palette(cluster_palette, n_components)
-        labels = np.unique(Y_)
-        cluster_palette = dict(zip(np.unique(labels), colors))
-        label_palette = dict(zip(np.unique(np.asarray(labels)), colors))
+        # no labels given we go to default, where labels are the clusters
+        label_palette = cluster_palette
 
-    with sns.plotting_context(context=context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         dimensions = X.shape[1]
         # we only want 1 scatter plot for 2 features
         if X.shape[1] == 2:
@@ -914,21 +1178,37 @@ def pairplot_with_gmm(
 
         if histplot_kws is None:
             histplot_kws = {}
-
+        # bin and style each cluster on its own, as separate histplot calls would
+        histplot_kws = {
+            "common_bins": False,
+            "common_norm": False,
+            "alpha": 0.75,
+            **histplot_kws,
+        }
+        # the diagonal histograms color each cluster with a label color
+        hist_palette = dict(zip(unique_clusters, label_palette.values()))
+        hist_order = list(hist_palette)
+
+        dim_labels = ["Dimension " + str(k + 1) for k in range(X.shape[1])]
         for i in range(dimensions):
             for j in range(dimensions):
+                ax = axes[dimensions * i + j]
                 if i == j and X.shape[1] > 2:
-                    # take care of the histplot on diagonal
-                    for t, lab in zip([i for i in range(X.shape[1])], label_palette):
-                        sns.histplot(
-                            X[Y_ == t, i],
-                            ax=axes[dimensions * i + j],
-                            color=label_palette[lab],
-                            **histplot_kws,
-                        )
+                    # take care of the histplot on diagonal, one grouped call
+                    sns.histplot(
+                        data=data,
+                        x=i,
+                        hue="clusters",
+                        hue_order=hist_order,
+                        palette=hist_palette,
+                        multiple="layer",
+                        legend=False,
+                        ax=ax,
+                        **histplot_kws,
+                    )
                     # this removes the tick marks from the histplot
-                    axes[dimensions * i + j].set_xticks([])
-                    axes[dimensions * i + j].set_yticks([])
+                    ax.set_xticks([])
+                    ax.set_yticks([])
                 else:
                     # take care off off-diagonal scatterplots
                     dim1, dim2 = j, i
@@ -943,27 +1223,23 @@ def pairplot_with_gmm(
                         dim2,
                         means,
                         covariances,
-                        axes[dimensions * i + j],
+                        ax,
                         label_palette,
                         cluster_palette,
                         alpha=alpha,
                     )
-        # formatting
-        if title:
-            plt.suptitle(title)
-        for i in range(dimensions):
-            for j in range(dimensions):
+                # formatting, in the same pass over the axes
                 if X.shape[1] == 2:
-                    axes[dimensions * i + j].set_ylabel("Dimension " + str(1))
-                    axes[dimensions * i + j].set_xlabel("Dimension " + str(2))
+                    ax.set_ylabel(dim_labels[0])
+                    ax.set_xlabel(dim_labels[1])
                 else:
-                    axes[dimensions * i + j].set_ylabel("Dimension " + str(i + 1))
-                    axes[dimensions * i + j].set_xlabel("Dimension " + str(j + 1))
-
-        for ax in axes.flat:
-            ax.label_outer()
-            ax.spines["right"].set_visible(False)
-            ax.spines["top"].set_visible(False)
+                    ax.set_ylabel(dim_labels[i])
+                    ax.set_xlabel(dim_labels[j])
+                ax.label_outer()
+                ax.spines["right"].set_visible(False)
+                ax.spines["top"].set_visible(False)
+        if title:
+            plt.suptitle(title)
         # set up the legend correctly by only getting handles(colored dot)
         # and label corresponding to unique pairs
         if X.shape[1] == 2:
@@ -999,18 +1275,29 @@ def _distplot(
     ax = plt.gca()
     palette = sns.color_palette(palette)
     plt_kws = {"cumulative": True}
-    with sns.plotting_context(context=context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         if labels is not None:
+            labels = np.asarray(labels)
             categories, counts = np.unique(labels, return_counts=True)
+            # group the data by label once, then each category is one slice
+            sorted_data = data[np.argsort(labels, kind="stable")]
+            bounds = np.r_[0, counts.cumsum()]
+            # every ECDF goes into one LineCollection, with proxies for the legend
+            segments, segment_colors, handles = [], [], []
             for i, cat in enumerate(categories):
-                cat_data = data[np.where(labels == cat)]
+                cat_data = sorted_data[bounds[i] : bounds[i + 1]]
                 if counts[i] > 1 and cat_data.min() != cat_data.max():
                     x = np.sort(cat_data)
                     y = np.arange(len(x)) / float(len(x))
-                    plt.plot(x, y, label=cat, color=palette[i])
+                    segments.append(np.column_stack((x, y)))
+                    segment_colors.append(palette[i])
+                    handles.append(Line2D([], [], label=cat, color=palette[i]))
                 else:
-                    ax.axvline(cat_data[0], label=cat, color=palette[i])
-            plt.legend()
+                    handles.append(ax.axvline(cat_data[0], label=cat, color=palette[i]))
+            if segments:
+                ax.add_collection(LineCollection(segments, colors=segment_colors))
+                ax.autoscale_view()
+            plt.legend(handles=handles)
         else:
             if data.min() != data.max():
                 sns.histplot(data, hist=False, kde_kws=plt_kws)
@@ -1142,11 +1429,12 @@ def edgeplot(
     check_array(X)
     check_consistent_length((X, labels))
     edges = X.ravel()
-    labels = np.tile(labels, (1, X.shape[1]))
-    labels = labels.ravel()  # type: ignore
+    # edge (i, j) belongs to row i, so each label repeats once per column
+    labels = np.repeat(np.asarray(labels), X.shape[1])
     if nonzero:
-        labels = labels[edges != 0]
-        edges = edges[edges != 0]
+        idx = np.flatnonzero(edges)
+        labels = labels[idx]
+        edges = edges[idx]
     ax = _distplot(
         edges,
         labels=labels,
@@ -1316,7 +1604,8 @@ def networkplot(
             raise ValueError(
                 "If x and y are strings, node_data must be pandas DataFrame."
             )
-        plot_df = node_data.copy()
+        # plot_df is only read from, so node_data needs no copy
+        plot_df = node_data
         x_key = x
         y_key = y
         if node_hue is not None:
@@ -1332,42 +1621,45 @@ def networkplot(
     else:
         raise TypeError("x and y must be numpy arrays or strings.")
 
-    pre_inds, post_inds = adjacency.nonzero()
-    pre = np.array(index)[pre_inds.astype(int)]
-    post = np.array(index)[post_inds.astype(int)]
+    # nodes are indexed by position, so the nonzero indices are the node ids
+    pre, post = adjacency.nonzero()
     rows = {"source": pre, "target": post}
 
-    edgelist = pd.DataFrame(rows)
-    pre_edgelist = edgelist.copy()
-    post_edgelist = edgelist.copy()
-
-    pre_edgelist["x"] = pre_edgelist["source"].map(plot_df[x_key])
-    pre_edgelist["y"] = pre_edgelist["source"].map(plot_df[y_key])
-    post_edgelist["x"] = post_edgelist["target"].map(plot_df[x_key])
-    post_edgelist["y"] = post_edgelist["target"].map(plot_df[y_key])
-    pre_coords = list(zip(pre_edgelist["x"], pre_edgelist["y"]))
-    post_coords = list(zip(post_edgelist["x"], post_edgelist["y"]))
-    coords = list(zip(pre_coords, post_coords))
+    # each segment runs from the source node to the target node
+    xs = plot_df[x_key].to_numpy()
+    ys = plot_df[y_key].to_numpy()
+    coords = np.empty((len(pre), 2, 2))
+    coords[:, 0, 0] = xs[pre]
+    coords[:, 0, 1] = ys[pre]
+    coords[:, 1, 0] = xs[post]
+    coords[:, 1, 1] = ys[post]
 
     plot_palette: Optional[Dict]
 
     if node_hue is not None:
+        # codes index the hue levels in order of appearance, like unique()
+        hue_codes, hue_levels = pd.factorize(plot_df[hue_key])
+        hue_palette: Dict
         if isinstance(palette, str):
-            sns_palette: List = sns.color_palette(
-                palette, n_colors=len(plot_df[hue_key].unique())
-            )
-            plot_palette = dict(zip(plot_df[hue_key].unique(), sns_palette))
+            sns_palette: List = sns.color_palette(palette, n_colors=len(hue_levels))
+            hue_palette = dict(zip(hue_levels, sns_palette))
         elif isinstance(palette, list):
-            plot_palette = dict(zip(plot_df[hue_key].unique(), palette))
+            hue_palette = dict(zip(hue_levels, palette))
         elif isinstance(palette, dict):
-            plot_palette = palette
-        edgelist[hue_key] = edgelist[edge_hue].map(plot_df[hue_key])
-        edge_colors = edgelist[hue_key].map(plot_palette)
+            hue_palette = palette
+        else:
+            msg = "palette must be a string, list or dict, not {}.".format(
+                type(palette)
+            )
+            raise TypeError(msg)
+        plot_palette = hue_palette
+        level_colors = mpl.colors.to_rgba_array([hue_palette[h] for h in hue_levels])
+        edge_colors = level_colors[hue_codes[rows[edge_hue]]]
     else:
         plot_palette = None
         edge_colors = None
 
-    with sns.plotting_context(context=context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         if ax is None:
             _, ax = plt.subplots(1, 1, figsize=figsize)
         sns.scatterplot(
@@ -1446,7 +1738,8 @@ def screeplot(
     if not isinstance(cumulative, bool):
         msg = "cumulative must be a boolean"
         raise TypeError(msg)
-    _, D, _ = select_svd(X, n_components=X.shape[1], algorithm="full")
+    # the ratios need every singular value, but never the singular vectors
+    D = np.linalg.svd(X, compute_uv=False)
     D /= D.sum()
     if cumulative:
         y = np.cumsum(D[:show_first])
@@ -1456,7 +1749,7 @@ def screeplot(
     ax = plt.gca()
     xlabel = "Component"
     ylabel = "Variance explained"
-    with sns.plotting_context(context=context, font_scale=font_scale):
+    with _plotting_context(context, font_scale):
         plt.plot(y)
         plt.title(title)
         plt.xlabel(xlabel)
@@ -1464,80 +1757,103 @@ def screeplot(
     return ax
 
 
+def _label_sort_keys(inner_labels: np.ndarray, outer_labels: np.ndarray) -> List:
+    # rank labels alphabetically and get their frequencies so we can sort by them
+    inner_codes, inner_label_counts = _get_freq_vec(inner_labels)
+    outer_codes, outer_label_counts = _get_freq_vec(outer_labels)
+
+    # negate counts so we can sort largest to smallest
+    # would rather do it this way so can still sort alphabetical for ties
+    # lexsort is stable and sorts by its last key first
+    return [inner_codes, -inner_label_counts, outer_codes, -outer_label_counts]
+
+
 def _sort_inds(
-    graph: np.ndarray,
+    graph: Union[np.ndarray, csr_matrix],
     inner_labels: np.ndarray,
     outer_labels: np.ndarray,
     sort_nodes: bool,
 ) -> np.ndarray:
-    sort_df = pd.DataFrame(columns=("inner_labels", "outer_labels"))
-    sort_df["inner_labels"] = inner_labels
-    sort_df["outer_labels"] = outer_labels
+    keys = _label_sort_keys(inner_labels, outer_labels)
+    if sort_nodes:
+        # get node edge sums (not exactly degrees if weighted)
+        node_edgesums = (
+            np.asarray(graph.sum(axis=1)).ravel()
+            + np.asarray(graph.sum(axis=0)).ravel()
+        )
+        keys.insert(0, -node_edgesums)
+    return np.lexsort(keys)
 
-    # get frequencies of the different labels so we can sort by them
-    inner_label_counts = _get_freq_vec(inner_labels)
-    outer_label_counts = _get_freq_vec(outer_labels)
 
-    # inverse counts so we can sort largest to smallest
-    # would rather do it this way so can still sort alphabetical for ties
-    sort_df["inner_counts"] = len(inner_labels) - inner_label_counts
-    sort_df["outer_counts"] = len(outer_labels) - outer_label_counts
+# permutations from _label_sort_inds, keyed by the contents of the labels
+_LABEL_SORT_CACHE: Dict[Tuple[Any, Any], np.ndarray] = {}
+_LABEL_SORT_CACHE_SIZE = 8
 
-    # get node edge sums (not exactly degrees if weighted)
-    node_edgesums = graph.sum(axis=1) + graph.sum(axis=0)
-    sort_df["node_edgesums"] = node_edgesums.max() - node_edgesums
 
-    if sort_nodes:
-        by = [
-            "outer_counts",
-            "outer_labels",
-            "inner_counts",
-            "inner_labels",
-            "node_edgesums",
-        ]
-    else:
-        by = ["outer_counts", "outer_labels", "inner_counts", "inner_labels"]
-    sort_df.sort_values(by=by, kind="mergesort", inplace=True)
+def _labels_key(labels: np.ndarray) -> Tuple[Any, ...]:
+    if labels.dtype == object:
+        return (labels.dtype.str, tuple(labels.tolist()))
+    return (labels.dtype.str, labels.shape, labels.tobytes())
 
-    sorted_inds = sort_df.index.values
-    return sorted_inds
 
+def _label_sort_inds(inner_labels: np.ndarray, outer_labels: np.ndarray) -> np.ndarray:
+    """Same as ``_sort_inds`` without ``sort_nodes``, which does not depend on the
+    graph, so the result is cached for plots that reuse the same labels"""
+    try:
+        key = (_labels_key(inner_labels), _labels_key(outer_labels))
+        inds = _LABEL_SORT_CACHE.get(key)
+    except TypeError:  # unhashable object labels
+        return np.lexsort(_label_sort_keys(inner_labels, outer_labels))
+    if inds is None:
+        inds = np.lexsort(_label_sort_keys(inner_labels, outer_labels))
+        inds.setflags(write=False)
+        if len(_LABEL_SORT_CACHE) >= _LABEL_SORT_CACHE_SIZE:
+            del _LABEL_SORT_CACHE[next(iter(_LABEL_SORT_CACHE))]
+        _LABEL_SORT_CACHE[key] = inds
+    return inds
 
-def _sort_graph(
-    graph: np.ndarray,
-    inner_labels: np.ndarray,
-    outer_labels: np.ndarray,
-    sort_nodes: bool,
-) -> np.ndarray:
-    inds = _sort_inds(graph, inner_labels, outer_labels, sort_nodes)
-    graph = graph[inds, :][:, inds]
-    return graph
+
+def _permute_graph(
+    graph: Union[np.ndarray, csr_matrix], inds: np.ndarray
+) -> Union[np.ndarray, csr_matrix]:
+    # row then column indexing also permutes a csr_matrix without densifying it
+    return graph[inds, :][:, inds]
+
+
+def _label_changes(labels: np.ndarray) -> np.ndarray:
+    # marks where each label differs from the one before it, treating neighboring
+    # missing labels as equal since they were sorted into a single group
+    change = labels[1:] != labels[:-1]
+    missing = pd.isna(labels)
+    return change & ~(missing[1:] & missing[:-1])
 
 
 def _get_freqs(
     inner_labels: np.ndarray, outer_labels: np.ndarray
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-    # use this because unique would give alphabetical
-    _, outer_freq = _unique_like(outer_labels)
+    # labels arrive sorted by outer then inner label, so every group is one
+    # contiguous run and its size is the distance between run boundaries
+    outer_change = _label_changes(outer_labels)
+    inner_change = outer_change | _label_changes(inner_labels)
+    outer_freq = np.diff(np.flatnonzero(np.r_[True, outer_change, True]))
     outer_freq_cumsum = np.hstack((0, outer_freq.cumsum()))
 
-    # for each group of outer labels, calculate the boundaries of the inner labels
-    inner_freq = np.array([])
-    for i in range(outer_freq.size):
-        start_ind = outer_freq_cumsum[i]
-        stop_ind = outer_freq_cumsum[i + 1]
-        _, temp_freq = _unique_like(inner_labels[start_ind:stop_ind])
-        inner_freq = np.hstack([inner_freq, temp_freq])
+    # inner runs never cross an outer boundary, so they split each outer group
+    inner_freq = np.diff(np.flatnonzero(np.r_[True, inner_change, True]))
     inner_freq_cumsum = np.hstack((0, inner_freq.cumsum()))
 
     return inner_freq, inner_freq_cumsum, outer_freq, outer_freq_cumsum
 
 
-def _get_freq_vec(vals: np.ndarray) -> np.ndarray:
-    # give each set of labels a vector corresponding to its frequency
-    _, inv, counts = np.unique(vals, return_counts=True, return_inverse=True)
-    count_vec = counts[inv]
-    return count_vec
+def _get_freq_vec(vals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # give each label its alphabetical rank and a vector of its frequency
+    # factorize hashes the labels, so only the unique labels are sorted
+    codes, _ = pd.factorize(vals, sort=True)
+    if (codes < 0).any():
+        # factorize codes missing labels as -1, so let unique group them instead
+        _, codes = np.unique(vals, return_inverse=True)
+    count_vec = np.bincount(codes)[codes]
+    return codes, count_vec
 
 
 def _unique_like(vals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
@@ -1549,6 +1865,24 @@ def _unique_like(vals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     return uniques, counts
 
 
+@lru_cache(maxsize=8)
+def _bracket_curve(n_half: int = 500) -> np.ndarray:
+    # generic curve that we will use for everything, shared read-only
+    lx = np.linspace(-np.pi / 2.0 + 0.05, np.pi / 2.0 - 0.05, n_half)
+    tan = np.tan(lx)
+    curve = np.hstack((tan[::-1], tan))
+    curve.setflags(write=False)
+    return curve
+
+
+@lru_cache(maxsize=8)
+def _bracket_base(n_samples: int) -> np.ndarray:
+    # bracket grid on [-1, 1], shifted and scaled to each bracket's span
+    base = np.linspace(-1.0, 1.0, n_samples)
+    base.setflags(write=False)
+    return base
+
+
 # assume that the graph has already been plotted in sorted form
 def _plot_groups(
     ax: matplotlib.pyplot.Axes,
@@ -1556,6 +1890,8 @@ def _plot_groups(
     inner_labels: Union[np.ndarray, List[Any]],
     outer_labels: Optional[Union[np.ndarray, List[Any]]] = None,
     fontsize: int = 30,
+    sorted_inds: Optional[np.ndarray] = None,
+    rasterized: bool = False,
 ) -> matplotlib.pyplot.Axes:
     inner_labels_arr = np.array(inner_labels)
     plot_outer = True
@@ -1565,36 +1901,46 @@ def _plot_groups(
     else:
         outer_labels_arr = np.array(outer_labels)
 
-    sorted_inds = _sort_inds(graph, inner_labels_arr, outer_labels_arr, False)
+    # any permutation that sorted the graph puts the labels in the same order
+    if sorted_inds is None:
+        sorted_inds = _label_sort_inds(inner_labels_arr, outer_labels_arr)
     inner_labels_arr = inner_labels_arr[sorted_inds]
     outer_labels_arr = outer_labels_arr[sorted_inds]
 
     inner_freq, inner_freq_cumsum, outer_freq, outer_freq_cumsum = _get_freqs(
         inner_labels_arr, outer_labels_arr
     )
-    inner_unique, _ = _unique_like(inner_labels_arr)
+    # name every inner group by the label at its start, once for both axes; this
+    # also holds when an outer group lacks some of the inner labels
+    inner_names = inner_labels_arr[inner_freq_cumsum[:-1]]
     outer_unique, _ = _unique_like(outer_labels_arr)
 
     n_verts = graph.shape[0]
-    axline_kws = dict(linestyle="dashed", lw=0.9, alpha=0.3, zorder=3, color="grey")
-    # draw lines
-    for x in inner_freq_cumsum[1:-1]:
-        ax.vlines(x, 0, n_verts + 1, **axline_kws)
-        ax.hlines(x, 0, n_verts + 1, **axline_kws)
-
-    # add specific lines for the borders of the plot
+    axline_kws = dict(
+        linestyles="dashed", linewidths=0.9, alpha=0.3, zorder=3, colors="grey"
+    )
+    # draw lines, a vertical and a horizontal one at each inner boundary
+    bounds = inner_freq_cumsum[1:-1]
+    segments = np.zeros((2 * len(bounds), 2, 2))
+    segments[: len(bounds), :, 0] = bounds[:, np.newaxis]
+    segments[: len(bounds), 1, 1] = n_verts + 1
+    segments[len(bounds) :, :, 1] = bounds[:, np.newaxis]
+    segments[len(bounds) :, 1, 0] = n_verts + 1
+    ax.add_collection(LineCollection(segments, **axline_kws))
+
+    # add specific lines for the borders of the plot, in axes coordinates
     pad = 0.001
     low = pad
     high = 1 - pad
-    ax.plot((low, low), (low, high), transform=ax.transAxes, **axline_kws)
-    ax.plot((low, high), (low, low), transform=ax.transAxes, **axline_kws)
-    ax.plot((high, high), (low, high), transform=ax.transAxes, **axline_kws)
-    ax.plot((low, high), (high, high), transform=ax.transAxes, **axline_kws)
-
-    # generic curve that we will use for everything
-    lx = np.linspace(-np.pi / 2.0 + 0.05, np.pi / 2.0 - 0.05, 500)
-    tan = np.tan(lx)
-    curve = np.hstack((tan[::-1], tan))
+    borders = [
+        ((low, low), (low, high)),
+        ((low, low), (high, low)),
+        ((high, low), (high, high)),
+        ((low, high), (high, high)),
+    ]
+    ax.add_collection(
+        LineCollection(borders, transform=ax.transAxes, **axline_kws), autolim=False
+    )
 
     divider = make_axes_locatable(ax)
 
@@ -1605,65 +1951,45 @@ def _plot_groups(
     outer_tick_loc = outer_freq.cumsum() - outer_freq / 2
     outer_tick_width = outer_freq / 2
 
-    # top inner curves
-    ax_x = divider.new_vertical(size="5%", pad=0.0, pack_start=False)
-    ax.figure.add_axes(ax_x)
-    _plot_brackets(
-        ax_x,
-        np.tile(inner_unique, len(outer_unique)),
-        inner_tick_loc,
-        inner_tick_width,
-        curve,
-        "inner",
-        "x",
-        n_verts,
-        fontsize,
-    )
-    # side inner curves
-    ax_y = divider.new_horizontal(size="5%", pad=0.0, pack_start=True)
-    ax.figure.add_axes(ax_y)
-    _plot_brackets(
-        ax_y,
-        np.tile(inner_unique, len(outer_unique)),
-        inner_tick_loc,
-        inner_tick_width,
-        curve,
-        "inner",
-        "y",
-        n_verts,
-        fontsize,
-    )
-
+    # one entry per set of brackets: its labels, ticks, side of the plot, and pad;
+    # inner brackets sit next to the plot, outer ones beyond them
+    specs = [
+        (inner_names, inner_tick_loc, inner_tick_width, "inner", "x", 0.0),
+        (inner_names, inner_tick_loc, inner_tick_width, "inner", "y", 0.0),
+    ]
     if plot_outer:
-        # top outer curves
         pad_scalar = 0.35 / 30 * fontsize
-        ax_x2 = divider.new_vertical(size="5%", pad=pad_scalar, pack_start=False)
-        ax.figure.add_axes(ax_x2)
-        _plot_brackets(
-            ax_x2,
-            outer_unique,
-            outer_tick_loc,
-            outer_tick_width,
-            curve,
-            "outer",
-            "x",
-            n_verts,
-            fontsize,
-        )
-        # side outer curves
-        ax_y2 = divider.new_horizontal(size="5%", pad=pad_scalar, pack_start=True)
-        ax.figure.add_axes(ax_y2)
-        _plot_brackets(
-            ax_y2,
-            outer_unique,
-            outer_tick_loc,
-            outer_tick_width,
-            curve,
-            "outer",
-            "y",
-            n_verts,
-            fontsize,
-        )
+        specs += [
+            (outer_unique, outer_tick_loc, outer_tick_width, "outer", "x", pad_scalar),
+            (outer_unique, outer_tick_loc, outer_tick_width, "outer", "y", pad_scalar),
+        ]
+
+    with _deferred_redraw(ax.figure):
+        # lay out every bracket axes on the divider before adding any to the figure;
+        # top brackets stack above the plot and side brackets to its left
+        bracket_axes = [
+            divider.new_vertical(size="5%", pad=pad, pack_start=False)
+            if axis == "x"
+            else divider.new_horizontal(size="5%", pad=pad, pack_start=True)
+            for _, _, _, _, axis, pad in specs
+        ]
+        for bracket_ax in bracket_axes:
+            ax.figure.add_axes(bracket_ax)
+
+        for bracket_ax, (names, tick_loc, tick_width, level, axis, _) in zip(
+            bracket_axes, specs
+        ):
+            _plot_brackets(
+                bracket_ax,
+                names,
+                tick_loc,
+                tick_width,
+                level,
+                axis,
+                n_verts,
+                fontsize,
+                rasterized=rasterized,
+            )
     return ax
 
 
@@ -1672,35 +1998,76 @@ def _plot_brackets(
     group_names: np.ndarray,
     tick_loc: np.ndarray,
     tick_width: np.ndarray,
-    curve: np.ndarray,
     level: str,
     axis: str,
     max_size: int,
     fontsize: int,
+    rasterized: bool = False,
 ) -> None:
-    for x0, width in zip(tick_loc, tick_width):
-        x = np.linspace(x0 - width, x0 + width, 1000)
-        if axis == "x":
-            ax.plot(x, -curve, c="k")
-            ax.patch.set_alpha(0)
-        elif axis == "y":
-            ax.plot(curve, x, c="k")
-            ax.patch.set_alpha(0)
-    ax.set_yticks([])
-    ax.set_xticks([])
+    tick_loc = np.ascontiguousarray(tick_loc, dtype=np.float64)
+    tick_width = np.ascontiguousarray(tick_width, dtype=np.float64)
+    # a group with a single member gets its tick and name but no bracket
+    drawn = tick_width > 0.5
+    # about two samples per pixel of the widest bracket, bounding its span by
+    # the figure's extent along the axis, is as fine as the curve can be seen
+    fig = ax.figure
+    extent = fig.get_figwidth() if axis == "x" else fig.get_figheight()
+    span = extent * fig.dpi * 2 * tick_width.max(initial=0) / max_size
+    n_half = int(np.clip(span, 16, 500))
+    curve = _bracket_curve(n_half)
+    # each bracket spans [x0 - width, x0 + width] at the resolution of the curve;
+    # all brackets are one path, written straight into its vertex buffer
+    base = _bracket_base(curve.size)
+    segments = np.empty((np.count_nonzero(drawn), curve.size, 2))
+    # brackets on top are flipped by negating the curve once
+    if axis == "x":
+        span, height = segments[..., 0], segments[..., 1]
+        height[:] = -curve
+    elif axis == "y":
+        span, height = segments[..., 1], segments[..., 0]
+        height[:] = curve
+    np.multiply(tick_width[drawn, np.newaxis], base, out=span)
+    span += tick_loc[drawn, np.newaxis]
+    # every bracket starts a new subpath of the single path
+    codes = np.full(segments.shape[0] * curve.size, Path.LINETO, dtype=Path.code_type)
+    codes[:: curve.size] = Path.MOVETO
+    brackets = PathPatch(
+        Path(segments.reshape(-1, 2), codes),
+        fill=False,
+        edgecolor="k",
+        linewidth=mpl.rcParams["lines.linewidth"],
+        rasterized=rasterized,
+    )
+    ax.add_patch(brackets)
+    ax.autoscale_view()
+    ax.patch.set_alpha(0)
+    # the brackets line up with the plot whether or not they are labeled
+    if axis == "x":
+        ax.set_xlim(0, max_size)
+    elif axis == "y":
+        # top to bottom, like the rows of the plot
+        ax.set_ylim(max_size, 0)
+    # nothing visible to label, so hide the whole axis in one call and skip the
+    # tick label machinery; labeled axes keep their axis and only lose the frame
+    if fontsize == 0 or all(str(name) == "" for name in group_names):
+        ax.set_axis_off()
+        return
+    _strip_axis(ax)
     ax.tick_params(axis=axis, which="both", length=0, pad=7)
-    for direction in ["left", "right", "bottom", "top"]:
-        ax.spines[direction].set_visible(False)
     if axis == "x":
         ax.set_xticks(tick_loc)
         ax.set_xticklabels(group_names, fontsize=fontsize, verticalalignment="center")
         ax.xaxis.set_label_position("top")
         ax.xaxis.tick_top()
         ax.xaxis.labelpad = 30
-        ax.set_xlim(0, max_size)
         ax.tick_params(axis="x", which="major", pad=5 + fontsize / 4)
     elif axis == "y":
         ax.set_yticks(tick_loc)
         ax.set_yticklabels(group_names, fontsize=fontsize, verticalalignment="center")
-        ax.set_ylim(0, max_size)
-        ax.invert_yaxis()
+
+
+def _strip_axis(ax: matplotlib.pyplot.Axes) -> None:
+    # hide the frame and ticks of an axis that only holds annotations
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.set(xticks=[], yticks=[])
@@ -61,21 +61,27 @@ def pass_to_ranks(
         )
 
     if method == "zero-boost":
-        if is_symmetric(graph):
+        # each of these checks is a full pass over the graph, so only do them once
+        symmetric = is_symmetric(graph)
+        if symmetric:
             # start by working with half of the graph, since symmetric
             triu = np.triu(graph)
-            non_zeros = triu[triu != 0]
+            nonzero_mask = triu != 0
+            non_zeros = triu[nonzero_mask]
         else:
-            non_zeros = graph[graph != 0]
+            nonzero_mask = graph != 0
+            non_zeros = graph[nonzero_mask]
         rank = rankdata(non_zeros)
 
-        if is_symmetric(graph):
+        if symmetric:
             if is_loopless(graph):
-                num_zeros = (len(graph[graph == 0]) - graph.shape[0]) / 2
+                num_zeros = (graph.size - 2 * len(non_zeros) - graph.shape[0]) / 2
                 possible_edges = graph.shape[0] * (graph.shape[0] - 1) / 2
             else:
                 num_zeros = (
-                    len(triu[triu == 0]) - graph.shape[0] * (graph.shape[0] - 1) / 2
+                    triu.size
+                    - len(non_zeros)
+                    - graph.shape[0] * (graph.shape[0] - 1) / 2
                 )
                 possible_edges = graph.shape[0] * (graph.shape[0] + 1) / 2
         else:
@@ -93,21 +99,21 @@ def pass_to_ranks(
         # normalize by the number of possible edges for this kind of graph
         rank = rank / possible_edges
         # put back into matrix form (and reflect over the diagonal if necessary)
-        if is_symmetric(graph):
-            triu[triu != 0] = rank
+        if symmetric:
+            triu[nonzero_mask] = rank
             graph = symmetrize(triu, method="triu")
         else:
-            graph[graph != 0] = rank
+            graph[nonzero_mask] = rank
         return graph
     elif method in ["simple-all", "simple-nonzero"]:
-        non_zeros = graph[graph != 0]
-        rank = rankdata(non_zeros)
+        nonzero_mask = graph != 0
+        rank = rankdata(graph[nonzero_mask])
         if method == "simple-all":
             normalizer = graph.size
         elif method == "simple-nonzero":
             normalizer = rank.shape[0]
         rank = rank / (normalizer + 1)
-        graph[graph != 0] = rank
+        graph[nonzero_mask] = rank
         return graph
     else:
         raise ValueError("Unsuported pass-to-ranks method")
@@ -4,14 +4,21 @@
 import unittest
 
 import beartype.roar
+import matplotlib as mpl
+import matplotlib.axes
 import matplotlib.pyplot as plt
+import networkx as nx
 import numpy as np
 import pandas as pd
+import seaborn as sns
 from scipy.sparse import csr_matrix
 from sklearn.mixture import GaussianMixture
 
 from graspologic.plot.plot import (
+    _plotting_context,
     _sort_inds,
+    _transform,
+    edgeplot,
     gridplot,
     heatmap,
     networkplot,
@@ -35,6 +42,13 @@ def _test_pairplot_with_gmm_inputs(caller: unittest.TestCase, **kws):
     with caller.assertRaises(NameError):
         pairplot_with_gmm(X, gmm=None)
 
+    # palettes are named in the error whether or not labels are given
+    with caller.assertRaisesRegex(ValueError, "cluster_palette"):
+        pairplot_with_gmm(X, gmm=gmm, cluster_palette=1)
+
+    with caller.assertRaisesRegex(ValueError, "label_palette"):
+        pairplot_with_gmm(X, gmm=gmm, labels=labels, label_palette=1)
+
 
 def _test_pairplot_with_gmm_outputs(**kws):
     X = np.random.rand(15, 3)
@@ -144,6 +158,14 @@ class TestPlot(unittest.TestCase):
         with self.assertRaises(TypeError):
             gridplot([X], hier_label_fontsize="f")
 
+    def test_plotting_context_none_uses_current_rc(self):
+        with mpl.rc_context():
+            for context in ["paper", "poster"]:
+                sns.set_context(context)
+                font_size = mpl.rcParams["font.size"]
+                with _plotting_context(None, 1):
+                    self.assertEqual(mpl.rcParams["font.size"], font_size)
+
     def test_heatmap_inputs(self):
         """
         test parameter checks
@@ -173,6 +195,10 @@ class TestPlot(unittest.TestCase):
             cbar = 1
             heatmap(X, cbar=cbar)
 
+        # downsample
+        with self.assertRaises(ValueError):
+            heatmap(X, fast=True, downsample="median")
+
     def test_heatmap_output(self):
         """
         simple function to see if plot is made without errors
@@ -189,6 +215,60 @@ class TestPlot(unittest.TestCase):
         fig = heatmap(X, transform="simple-nonzero")
         fig = heatmap(X, transform="binarize")
         fig = heatmap(X, cmap="gist_rainbow")
+        fig = heatmap(X, fast=True, xticklabels=xticklabels, yticklabels=yticklabels)
+        fig = heatmap(X, fast=True, inner_hier_labels=5 * ["a"] + 5 * ["b"])
+
+        # inner labels that do not appear in every outer group
+        inner = ["a", "a", "b", "b", "b", "c", "c", "c", "c", "d"]
+        outer = 5 * [0] + 5 * [1]
+        fig = heatmap(X, inner_hier_labels=inner, outer_hier_labels=outer)
+        inner_names = [t.get_text() for t in fig.figure.axes[-4].get_xticklabels()]
+        self.assertEqual(inner_names, ["b", "a", "c", "d"])
+        fig = heatmap(X, inner_hier_labels=inner, rasterize_brackets=True)
+
+        # integer labels of 0 still get a bracket label
+        fig = heatmap(X, inner_hier_labels=[0] * 10)
+        names = [t.get_text() for a in fig.figure.axes for t in a.get_xticklabels()]
+        self.assertEqual(names, ["0"])
+        fig = heatmap(
+            X, inner_hier_labels=5 * [0] + 5 * [1], outer_hier_labels=10 * [0]
+        )
+        names = [t.get_text() for a in fig.figure.axes for t in a.get_xticklabels()]
+        self.assertEqual(names, ["0", "1", "0"])
+
+    def test_heatmap_sparse_output(self):
+        X = er_np(10, 0.5)
+        X_sparse = csr_matrix(X)
+        for transform in [None, "log", "log10", "binarize", "zero-boost"]:
+            fig = heatmap(X_sparse, transform=transform)
+
+        # sparse transforms should match their dense counterparts
+        for transform in ["log", "log10", "binarize"]:
+            np.testing.assert_array_almost_equal(
+                _transform(X_sparse, transform).toarray(), _transform(X, transform)
+            )
+
+    def test_heatmap_downsample(self):
+        # 401 does not divide into blocks, so the last row and column are ragged
+        X = np.zeros((401, 401))
+        X[0, 0] = 1
+        X[-1, -1] = 1
+        for downsample in ["max", "mean"]:
+            ax = heatmap(
+                X, fast=True, figsize=(1, 1), cbar=False, downsample=downsample
+            )
+            image = ax.images[0]
+            reduced = image.get_array()
+            self.assertLess(reduced.shape[0], X.shape[0])
+            self.assertEqual(list(image.get_extent()), [0, 401, 401, 0])
+            block_size = -(-X.shape[0] // reduced.shape[0])
+            expected = 1 if downsample == "max" else 1 / block_size**2
+            self.assertAlmostEqual(reduced[0, 0], expected)
+            self.assertEqual(reduced[-1, -1], 1)
+            self.assertAlmostEqual(reduced.sum(), 1 + expected)
+
+        ax = heatmap(X, fast=True, figsize=(1, 1), cbar=False, downsample=None)
+        self.assertEqual(ax.images[0].get_array().shape, X.shape)
 
     def test_gridplot_inputs(self):
         X = [er_np(10, 0.5)]
@@ -214,6 +294,17 @@ class TestPlot(unittest.TestCase):
         fig = gridplot(X, labels)
         fig = gridplot(X, labels, transform="zero-boost")
         fig = gridplot(X, labels, "simple-all", title="Test", font_scale=0.9)
+        fig = gridplot([nx.from_numpy_array(x) for x in X], labels)
+        fig = gridplot([csr_matrix(x) for x in X], labels, transform="log")
+
+    def test_gridplot_returns_axes_with_legend(self):
+        X = [er_np(10, 0.5) for _ in range(2)]
+        labels = ["Random A", "Random B"]
+        ax = gridplot(X, labels, legend_name="Graph")
+        self.assertIsInstance(ax, matplotlib.axes.Axes)
+        legend = ax.get_legend()
+        self.assertEqual(legend.get_title().get_text(), "Graph")
+        self.assertEqual([t.get_text() for t in legend.get_texts()], labels)
 
     def test_pairplot_inputs(self):
         X = np.random.rand(15, 3)
@@ -279,6 +370,17 @@ class TestPlot(unittest.TestCase):
     def test_pairplot_with_gmm_outputs_type_spherical(self):
         _test_pairplot_with_gmm_outputs(covariance_type="spherical")
 
+    def test_edgeplot_labels_follow_rows(self):
+        # edge (i, j) belongs to row i, so each label only sees its own rows
+        X = np.full((6, 6), 5.0)
+        X[:3] = np.arange(1, 19).reshape(3, 6)
+        labels = ["a"] * 3 + ["b"] * 3
+        ax = edgeplot(X, labels=labels)
+        (segment,) = ax.collections[0].get_segments()
+        np.testing.assert_array_equal(segment[:, 0], np.arange(1, 19))
+        (line,) = ax.lines
+        self.assertEqual(line.get_xdata()[0], 5)
+
     def test_networkplot_inputs(self):
         X = np.random.rand(15, 3)
         x = np.random.rand(15, 1)
@@ -413,3 +515,12 @@ class TestPlot(unittest.TestCase):
         self.assertTrue(np.all(np.diff(degrees[75:100]) <= 0))
         self.assertTrue(np.all(np.diff(degrees[100:110]) <= 0))
         self.assertTrue(np.all(np.diff(degrees[110:]) <= 0))
+
+    def test_sort_inds_nan_labels(self):
+        X = er_np(6, 0.5)
+        labels = np.array([1.0, 1.0, np.nan, 2.0, 2.0, np.nan])
+        sorted_inds = _sort_inds(X, labels, np.ones(6), False)
+        np.testing.assert_array_equal(sorted_inds, [0, 1, 3, 4, 2, 5])
+        fig = heatmap(X, inner_hier_labels=labels)
+        names = [t.get_text() for a in fig.figure.axes for t in a.get_xticklabels()]
+        self.assertEqual(names, ["1.0", "2.0", "nan"])